@@ -1,26 +1,94 @@
 import re
-import time
 import sys
+import threading
+import time
 import winreg
+from concurrent.futures import Future, wait as futures_wait
 from datetime import datetime
 from pathlib import Path
 import logging
+from logging.handlers import MemoryHandler
+
+# Все интересующие строки лога одним выражением; имя внешней группы
+# (match.lastgroup) определяет тип найденной записи.
+# Лог разбирается как bytes, декодируются только найденные значения
+_LOG_RE = re.compile(
+    rb'(?P<appid>AppID\s+(?P<appid_value>\d+))'
+    rb'|(?P<speed>Current download rate:\s+(?P<speed_value>[\d.]+)\s+Mbps)'
+    rb'|(?P<status>App update changed(?P<status_text>[^\n]*?'
+    rb'(?:Downloading|Paused|Verifying|Preallocating|Staging)[^\n]*))'
+    rb'|(?P<size>update started[^\n]*?download\s+(?P<downloaded>\d+)/(?P<total>\d+))'
+)
+# Типы записей - имена внешних групп _LOG_RE
+_LOG_RECORD_KINDS = frozenset({'appid', 'speed', 'status', 'size'})
+
+# Перевод статусов загрузки из лога Steam в порядке приоритета:
+# если в строке несколько статусов, побеждает первый из списка
+_STATUS_PRIORITY = (
+    (b'Downloading', 'загружается'),
+    (b'Paused', 'на паузе'),
+    (b'Verifying', 'проверка файлов'),
+    (b'Preallocating', 'подготовка места'),
+    (b'Staging', 'распаковка'),
+)
+
+# Единицы размера от большей к меньшей
+_SIZE_UNITS = (
+    (1 << 30, 'GB'),
+    (1 << 20, 'MB'),
+    (1 << 10, 'KB'),
+)
+
+# Сколько последних строк лога анализировать и размер читаемого хвоста файла
+TAIL_LINES = 50
+TAIL_BLOCK_SIZE = 64 * 1024
+# Поле "name" находится в начале манифеста, весь файл читать не нужно
+MANIFEST_HEAD_SIZE = 4096
+_MANIFEST_NAME_KEY = '"name"'
+# Сколько секунд доверять закэшированному пути Steam из реестра
+STEAM_PATH_TTL = 300
+# Максимальный отрезок ожидания, чтобы Ctrl+C срабатывал без задержки
+WAIT_SLICE = 1
+# Минимальное время ожидания разбора лога, независимо от интервала проверок
+PARSE_MIN_WAIT = 5
+# Результат разбора лога, когда информации о загрузке нет
+NO_DOWNLOAD_INFO = (None, None, "неизвестно", None, None, None)
+# Разделитель между проверками в выводе
+SEPARATOR = '=' * 80
+
 
 class SteamDownloadMonitor:
+    # Путь Steam из реестра, общий для всех экземпляров: (время получения, путь)
+    _steam_path_cache = None
+
     def __init__(self, log_to_file=True, log_file_path=None):
 
         self.setup_logging(log_to_file, log_file_path)
         self.logger = logging.getLogger('SteamMonitor')
         self.steam_path = self.get_steam_path()
-        self.log_file = self.steam_path / "logs" / "content_log.txt"
+        self._logs_dir = self.steam_path / "logs"
+        self._steamapps = self.steam_path / "steamapps"
+        self.log_file = self._logs_dir / "content_log.txt"
         self.current_appid = None
         self.game_name = None
         self.last_check_time = None
+        # Событие остановки: позволяет прервать ожидание между проверками
+        self._stop_event = threading.Event()
+        # Кэш разбора лога: (st_mtime_ns, st_size, результат)
+        self._log_cache = None
+        # Кэш названий игр: appid -> (st_mtime_ns манифеста, название)
+        self._name_cache = {}
+        # Пути к манифестам: appid -> Path
+        self._manifest_paths = {}
 
     def setup_logging(self, log_to_file=True, log_file_path=None):
         """Настройка системы логирования"""
         logger = logging.getLogger('SteamMonitor')
+        # Логгер общий для всех экземпляров - не добавляем обработчики повторно
+        if logger.handlers:
+            return
         logger.setLevel(logging.INFO)
+        logger.propagate = False
 
         # Формат сообщений
         formatter = logging.Formatter(
@@ -42,109 +110,156 @@ class SteamDownloadMonitor:
             file_handler = logging.FileHandler(log_file_path, encoding='utf-8')
             file_handler.setLevel(logging.INFO)
             file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            # Буферизуем записи в файл; ошибки сбрасываются на диск сразу
+            memory_handler = MemoryHandler(64, flushLevel=logging.ERROR, target=file_handler)
+            memory_handler.setLevel(logging.INFO)
+            logger.addHandler(memory_handler)
 
-            logger.info(f"Логирование в файл: {log_file_path}")
+            logger.info("Логирование в файл: %s", log_file_path)
 
     def get_steam_path(self):
         """Получает путь установки Steam из реестра"""
+        cached = SteamDownloadMonitor._steam_path_cache
+        if cached is not None and time.monotonic() - cached[0] < STEAM_PATH_TTL:
+            return cached[1]
+
         try:
             with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Valve\Steam") as key:
                 steam_path = Path(winreg.QueryValueEx(key, "SteamPath")[0])
-                self.logger.info(f"Найден Steam в: {steam_path}")
+                self.logger.info("Найден Steam в: %s", steam_path)
+                SteamDownloadMonitor._steam_path_cache = (time.monotonic(), steam_path)
                 return steam_path
         except Exception as e:
-            self.logger.error(f"Ошибка поиска Steam: {e}")
+            self.logger.error("Ошибка поиска Steam: %s", e)
             # Альтернативный путь
             default_path = Path("C:/Steam")
             if default_path.exists():
-                self.logger.info(f"Использую стандартный путь: {default_path}")
+                self.logger.info("Использую стандартный путь: %s", default_path)
                 return default_path
             self.logger.error("Steam не найден. Убедитесь, что Steam установлен")
             sys.exit(1)
 
     def get_game_name_from_manifest(self, appid):
         """Получает название игры из файла манифеста"""
-        manifest_file = self.steam_path / "steamapps" / f"appmanifest_{appid}.acf"
+        manifest_file = self._manifest_paths.get(appid)
+        if manifest_file is None:
+            manifest_file = self._steamapps / f"appmanifest_{appid}.acf"
+            self._manifest_paths[appid] = manifest_file
 
-        if manifest_file.exists():
-            try:
-                with open(manifest_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    # Ищем название игры в манифесте
-                    name_match = re.search(r'"name"\s+"([^"]+)"', content)
-                    if name_match:
-                        return name_match.group(1)
-                    else:
-                        # Пробуем найти в другом формате
-                        name_match = re.search(r'name\s+"([^"]+)"', content)
-                        if name_match:
-                            return name_match.group(1)
-            except Exception as e:
-                self.logger.error(f"Ошибка чтения манифеста: {e}")
+        try:
+            # Вместо exists() + stat() один stat(): отсутствие файла дает FileNotFoundError
+            mtime_ns = manifest_file.stat().st_mtime_ns
+            # Манифест не менялся - берем название из кэша, не открывая файл
+            entry = self._name_cache.get(appid)
+            if entry and entry[0] == mtime_ns:
+                return entry[1]
+
+            with open(manifest_file, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read(MANIFEST_HEAD_SIZE)
+
+            # Ищем название игры в манифесте: "name"\t\t"..."
+            key_pos = content.find(_MANIFEST_NAME_KEY)
+            if key_pos >= 0:
+                start = content.find('"', key_pos + len(_MANIFEST_NAME_KEY))
+                end = content.find('"', start + 1) if start >= 0 else -1
+                # Пустое название не принимаем - вернем заглушку
+                if end > start + 1:
+                    name = content[start + 1:end]
+                    self._name_cache[appid] = (mtime_ns, name)
+                    return name
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error("Ошибка чтения манифеста: %s", e)
 
         # Если не нашли, возвращаем заглушку
         return f"Игра (AppID: {appid})"
 
+    def read_log_tail(self, max_lines=TAIL_LINES, size=None):
+        """Читает последние строки лог-файла (bytes), не загружая его целиком"""
+        if size is None:
+            size = self.log_file.stat().st_size
+        block_size = TAIL_BLOCK_SIZE
+
+        with open(self.log_file, 'rb') as f:
+            # Читаем хвост файла; если строк не хватило, один раз удваиваем окно
+            for _ in range(2):
+                offset = max(0, size - block_size)
+                f.seek(offset)
+                tail = f.read()
+                lines = tail.splitlines()
+                if offset > 0:
+                    # Первая строка блока, скорее всего, обрезана
+                    lines = lines[1:]
+                if len(lines) >= max_lines or offset == 0:
+                    break
+                block_size *= 2
+
+        return lines[-max_lines:]
+
     def parse_log_file(self):
         """Парсит лог-файл и извлекает информацию о загрузке"""
-        if not self.log_file.exists():
-            self.logger.warning(f"Файл логов не найден: {self.log_file}")
-            return None, None, None
-
         try:
-            with open(self.log_file, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-                # Читаем последние 50 строк
-                if len(lines) > 50:
-                    lines = lines[-50:]
-                else:
-                    lines = lines
+            stat = self.log_file.stat()
+
+            # Если файл не менялся с прошлой проверки, повторно не разбираем
+            if self._log_cache is not None:
+                cached_mtime, cached_size, cached_result = self._log_cache
+                if cached_mtime == stat.st_mtime_ns and cached_size == stat.st_size:
+                    return cached_result
+
+            lines = self.read_log_tail(size=stat.st_size)
+        except FileNotFoundError:
+            self._log_cache = None
+            self.logger.warning("Файл логов не найден: %s", self.log_file)
+            return NO_DOWNLOAD_INFO
         except Exception as e:
-            self.logger.error(f"Ошибка чтения лог-файла: {e}")
-            return None, None, None
+            self.logger.error("Ошибка чтения лог-файла: %s", e)
+            return NO_DOWNLOAD_INFO
+
+        result = self.parse_log_lines(lines)
+        self._log_cache = (stat.st_mtime_ns, stat.st_size, result)
+        return result
+
+    def parse_log_lines(self, lines):
+        """Извлекает информацию о загрузке из последних строк лога"""
+        # Steam простаивает: в хвосте нет ни AppID, ни скорости загрузки
+        if not any(b'AppID' in line or b'Current download rate' in line for line in lines):
+            return NO_DOWNLOAD_INFO
+
+        # Анализируем строки с конца к началу: для каждого типа записи
+        # берем самое свежее совпадение и выходим, как только найдены все
+        found = {}
+        for line in reversed(lines):
+            line_matches = {}
+            for match in _LOG_RE.finditer(line):
+                line_matches[match.lastgroup] = match
+            for kind, match in line_matches.items():
+                found.setdefault(kind, match)
+            if found.keys() >= _LOG_RECORD_KINDS:
+                break
 
         appid = None
         download_speed = None
         status = "неизвестно"
 
-        # Анализируем строки с конца к началу
-        for line in reversed(lines):
-            # Ищем AppID текущей загрузки
-            if appid is None:
-                appid_match = re.search(r'AppID\s+(\d+)', line)
-                if appid_match:
-                    appid = appid_match.group(1)
-
-            # Ищем текущую скорость загрузки
-            if download_speed is None:
-                speed_match = re.search(r'Current download rate:\s+([\d.]+)\s+Mbps', line)
-                if speed_match:
-                    download_speed = float(speed_match.group(1))
-
-            # Определяем статус загрузки
-            if 'App update changed' in line:
-                if 'Downloading' in line:
-                    status = 'загружается'
-                elif 'Paused' in line:
-                    status = 'на паузе'
-                elif 'Verifying' in line:
-                    status = 'проверка файлов'
-                elif 'Preallocating' in line:
-                    status = 'подготовка места'
-                elif 'Staging' in line:
-                    status = 'распаковка'
-
-            # Ищем информацию о размере загрузки
-            if 'update started' in line and appid:
-                # Пример строки: update started : download 0/24012859376
-                size_match = re.search(r'download\s+(\d+)/(\d+)', line)
-                if size_match:
-                    downloaded = int(size_match.group(1))
-                    total = int(size_match.group(2))
-                    if total > 0:
-                        progress = (downloaded / total) * 100
-                        return appid, download_speed, status, progress, downloaded, total
+        if 'appid' in found:
+            appid = found['appid'].group('appid_value').decode('ascii')
+        if 'speed' in found:
+            download_speed = float(found['speed'].group('speed_value'))
+        if 'status' in found:
+            status_text = found['status'].group('status_text')
+            status = next(label for word, label in _STATUS_PRIORITY if word in status_text)
+
+        # Ищем информацию о размере загрузки
+        # Пример строки: update started : download 0/24012859376
+        size_match = found.get('size')
+        if size_match and appid:
+            downloaded = int(size_match.group('downloaded'))
+            total = int(size_match.group('total'))
+            if total > 0:
+                progress = (downloaded / total) * 100
+                return appid, download_speed, status, progress, downloaded, total
 
         return appid, download_speed, status, None, None, None
 
@@ -163,22 +278,20 @@ class SteamDownloadMonitor:
         if bytes_size is None:
             return "неизвестно"
 
-        if bytes_size >= 1024 ** 3:  # GB
-            return f"{bytes_size / (1024 ** 3):.2f} GB"
-        elif bytes_size >= 1024 ** 2:  # MB
-            return f"{bytes_size / (1024 ** 2):.2f} MB"
-        elif bytes_size >= 1024:  # KB
-            return f"{bytes_size / 1024:.2f} KB"
-        else:
-            return f"{bytes_size} B"
+        for scale, unit in _SIZE_UNITS:
+            if bytes_size >= scale:
+                return f"{bytes_size / scale:.2f} {unit}"
+        return f"{bytes_size} B"
 
-    def display_info(self, check_number, total_checks):
+    def display_info(self, check_number, total_checks, parsed=None):
         """Отображает информацию о загрузке"""
-        appid, speed, status, progress, downloaded, total = self.parse_log_file()
+        if parsed is None:
+            parsed = self.parse_log_file()
+        appid, speed, status, progress, downloaded, total = parsed
 
-        self.logger.info(f"\n{'=' * 80}")
-        self.logger.info(f"Проверка {check_number}/{total_checks} - {datetime.now().strftime('%H:%M:%S')}")
-        self.logger.info(f"{'=' * 80}")
+        self.logger.info("\n%s", SEPARATOR)
+        self.logger.info("Проверка %d/%d - %s", check_number, total_checks, datetime.now().strftime('%H:%M:%S'))
+        self.logger.info(SEPARATOR)
 
         if appid:
             # Получаем имя игры, если оно изменилось или еще не получено
@@ -186,58 +299,133 @@ class SteamDownloadMonitor:
                 self.game_name = self.get_game_name_from_manifest(appid)
                 self.current_appid = appid
 
-            self.logger.info(f"Игра: {self.game_name}")
-            self.logger.info(f"AppID: {appid}")
-            self.logger.info(f"Статус: {status}")
+            self.logger.info("Игра: %s", self.game_name)
+            self.logger.info("AppID: %s", appid)
+            self.logger.info("Статус: %s", status)
 
-            if speed is not None and status == 'загружается':
-                self.logger.info(f"Скорость: {self.format_speed(speed)}")
+            # Форматирование скорости и размеров - только если сообщения будут выведены
+            if self.logger.isEnabledFor(logging.INFO):
+                if speed is not None and status == 'загружается':
+                    self.logger.info("Скорость: %s", self.format_speed(speed))
 
-            if progress is not None:
-                self.logger.info(f"Прогресс: {progress:.1f}%")
-                self.logger.info(f"Загружено: {self.format_size(downloaded)} / {self.format_size(total)}")
+                if progress is not None:
+                    self.logger.info("Прогресс: %.1f%%", progress)
+                    self.logger.info("Загружено: %s / %s", self.format_size(downloaded), self.format_size(total))
 
-            self.logger.info(f"Состояние: {status}")
+            self.logger.info("Состояние: %s", status)
         else:
             self.logger.info("Нет активных загрузок")
 
     def monitor(self, duration_minutes=5, interval_seconds=60):
         """Основной цикл мониторинга"""
-        self.logger.info(f"\nЗапуск мониторинга загрузок Steam")
-        self.logger.info(f"Лог-файл: {self.log_file}")
-        self.logger.info(f"Длительность: {duration_minutes} минут")
-        self.logger.info(f"Интервал: {interval_seconds} секунд")
-        self.logger.info(f"Папка Steam: {self.steam_path}")
+        self.logger.info("\nЗапуск мониторинга загрузок Steam")
+        self.logger.info("Лог-файл: %s", self.log_file)
+        self.logger.info("Длительность: %s минут", duration_minutes)
+        self.logger.info("Интервал: %s секунд", interval_seconds)
+        self.logger.info("Папка Steam: %s", self.steam_path)
 
         if not self.log_file.exists():
-            self.logger.warning(f"\nВнимание: Лог-файл не найден!")
+            self.logger.warning("\nВнимание: Лог-файл не найден!")
             self.logger.warning("Убедитесь, что Steam запущен и начата загрузка игры.")
-            self.logger.warning("Файл должен появиться по пути:", self.log_file)
+            self.logger.warning("Файл должен появиться по пути: %s", self.log_file)
 
         total_checks = duration_minutes
 
+        self._stop_event.clear()
+
+        # Разбор лога выполняется в отдельном потоке, чтобы медленный диск
+        # не сдвигал интервал между проверками
+        parse_future = None
+
         for check_number in range(1, total_checks + 1):
+            # Срок следующей проверки отсчитывается от начала текущей
+            now = time.monotonic()
+            deadline = now + interval_seconds
+            # Разбору даем не меньше PARSE_MIN_WAIT секунд даже при коротком интервале
+            parse_deadline = max(deadline, now + PARSE_MIN_WAIT)
             try:
-                self.display_info(check_number, total_checks)
+                # Незавершенный или уже готовый, но не показанный разбор
+                # с прошлой проверки используем, а не запускаем новый
+                if parse_future is None:
+                    parse_future = self._start_parse()
+
+                if self._wait_until(parse_deadline, parse_future):
+                    future, parse_future = parse_future, None
+                    self.display_info(check_number, total_checks, future.result())
+                elif self._stop_event.is_set():
+                    break
+                else:
+                    self.logger.warning(
+                        "Разбор лог-файла не завершился за %.0f секунд",
+                        parse_deadline - now,
+                    )
 
                 # ждем если не все
                 if check_number < total_checks:
-                    self.logger.warning(f"\nСледующая проверка через {interval_seconds} секунд...")
-                    for remaining in range(interval_seconds, 0, -10):
-                        if remaining % 30 == 0 or remaining <= 10:
-                            self.logger.warning(f" Осталось: {remaining} сек")
-                        time.sleep(10 if remaining > 10 else remaining)
+                    self.logger.warning(
+                        "\nСледующая проверка через %.0f секунд...",
+                        max(0, deadline - time.monotonic()),
+                    )
+                    if self._wait_until(deadline):
+                        break
 
             except KeyboardInterrupt:
                 self.logger.error("\n\nМониторинг прерван пользователем")
                 break
             except Exception as e:
-                self.logger.error(f"\nОшибка при проверке: {e}")
-                time.sleep(interval_seconds)
+                self.logger.error("\nОшибка при проверке: %s", e)
+                if self._wait_until(deadline):
+                    break
 
-        self.logger.info(f"\n{'=' * 80}")
+        self.logger.info("\n%s", SEPARATOR)
         self.logger.info("Мониторинг завершен")
 
+        # Сбрасываем буферизованные записи в лог-файл
+        for handler in self.logger.handlers:
+            handler.flush()
+
+    def _start_parse(self):
+        """Запускает разбор лога в фоновом потоке и возвращает его Future"""
+        future = Future()
+
+        def worker():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.parse_log_file())
+            except Exception as e:
+                future.set_exception(e)
+
+        # Не ThreadPoolExecutor: его рабочий поток ожидается при выходе из
+        # интерпретатора, а зависший разбор не должен задерживать завершение
+        threading.Thread(target=worker, name='SteamLogParser', daemon=True).start()
+        return future
+
+    def _wait_until(self, deadline, future=None):
+        """Ждет до deadline (time.monotonic()) завершения future или, без него, вызова stop()
+
+        Возвращает True, если дождались: future завершен либо вызван stop().
+        """
+        # Ждем короткими отрезками: на Windows длинное ожидание блокировки
+        # не прерывается по Ctrl+C до истечения таймаута
+        while True:
+            if future is not None and future.done():
+                return True
+            if self._stop_event.is_set():
+                return future is None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            timeout = min(WAIT_SLICE, remaining)
+            if future is None:
+                self._stop_event.wait(timeout)
+            else:
+                futures_wait([future], timeout=timeout)
+
+    def stop(self):
+        """Останавливает мониторинг, прерывая текущее ожидание"""
+        self._stop_event.set()
+
 
 def main():
     """Основная функция"""